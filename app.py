@@ -7,13 +7,23 @@ Ejecutar con: python app.py
 import os
 import sys
 import json
+import base64
 import webbrowser
 import threading
 import traceback
+import shutil
+import tempfile
+import zipfile
+import functools
+import gzip
+import hashlib
+import itertools
 import logging
-from datetime import datetime
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 import urllib.parse
 
 # Configure logging
@@ -46,11 +56,108 @@ def check_dependencies():
 check_dependencies()
 
 import pandas as pd
+from pandas.api.types import infer_dtype, is_numeric_dtype
+import numpy as np
 import re
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+from openpyxl.styles import Font, PatternFill, Border, Side, Alignment, NamedStyle
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
 from openpyxl.worksheet.datavalidation import DataValidation
+from openpyxl.writer.excel import ExcelWriter
+# True when openpyxl found lxml at import time and serializes XML with it
+from openpyxl.xml import LXML as OPENPYXL_LXML
+
+# Optional: Aho-Corasick automaton for substring filter matching
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Optional: faster JSON encoding
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: streaming xlsx writer for exports (openpyxl is used otherwise)
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# Optional: Rust-based Excel reader, used through pandas' 'calamine' engine
+# (pandas 2.2+); pandas picks its default engine otherwise
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+# pandas only knows the 'calamine' engine from 2.2 on; older versions raise ValueError
+PANDAS_VERSION = tuple(int(part) for part in re.findall(r'\d+', pd.__version__)[:2])
+EXCEL_READ_ENGINE = 'calamine' if python_calamine is not None and PANDAS_VERSION >= (2, 2) else None
+
+
+def json_bytes(data):
+    """Serialize data to UTF-8 JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data).encode('utf-8')
+
+
+def json_loads(body):
+    """Parse a UTF-8 JSON request body, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body.decode('utf-8'))
+
+# Shared openpyxl export styles. Style objects are immutable, so one instance
+# can be assigned to any number of cells instead of being rebuilt per cell.
+# Colors are full ARGB with an opaque alpha; 6-digit values get alpha 00
+CELL_BORDER = Border(
+    left=Side(style='thin', color='FFE2E8F0'),
+    right=Side(style='thin', color='FFE2E8F0'),
+    top=Side(style='thin', color='FFE2E8F0'),
+    bottom=Side(style='thin', color='FFE2E8F0')
+)
+HEADER_FONT = Font(bold=True, color="FFFFFFFF")
+HEADER_FILL = PatternFill(start_color="FF2563EB", end_color="FF2563EB", fill_type="solid")
+HEADER_ALIGN = Alignment(horizontal="center", vertical="center", wrap_text=True)
+ROW_HEADER_FONT = Font(bold=True)
+ROW_HEADER_FILL = PatternFill(start_color="FFF1F5F9", end_color="FFF1F5F9", fill_type="solid")
+ONE_FONT = Font(bold=True, color="FF16A34A")
+ONE_FILL = PatternFill(start_color="FFDCFCE7", end_color="FFDCFCE7", fill_type="solid")
+CENTER_ALIGN = Alignment(horizontal="center")
+
+# Excel column letters by 1-based column number (Excel allows 16384 columns)
+COLUMN_LETTERS = [''] + [get_column_letter(col_idx) for col_idx in range(1, 16385)]
+# Characters Excel does not allow in sheet titles
+SHEET_TITLE_TRANSLATION = str.maketrans({char: '_' for char in '\\/*?:[]'})
+
+# Exports up to this size are kept in memory before spilling to a temp file
+EXPORT_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+EXPORT_CHUNK_SIZE = 64 * 1024
+# Maximum number of workbooks generated at the same time
+EXPORT_WORKERS = 4
+# zlib level for the xlsx archive. Exports are downloaded from localhost, so a
+# fast level beats a small file; set MATRIX_EXPORT_ZIP_LEVEL=6 for zip's default
+EXPORT_ZIP_LEVEL = 1
+try:
+    EXPORT_ZIP_LEVEL = int(os.environ.get('MATRIX_EXPORT_ZIP_LEVEL', '1'))
+except ValueError:
+    logger.warning(f"MATRIX_EXPORT_ZIP_LEVEL={os.environ['MATRIX_EXPORT_ZIP_LEVEL']!r} is not an integer, using 1")
+if not 0 <= EXPORT_ZIP_LEVEL <= 9:
+    clamped_level = min(max(EXPORT_ZIP_LEVEL, 0), 9)
+    logger.warning(f"MATRIX_EXPORT_ZIP_LEVEL={EXPORT_ZIP_LEVEL} is outside 0-9, using {clamped_level}")
+    EXPORT_ZIP_LEVEL = clamped_level
+# Total size of recent export files kept to answer repeated exports of the same matrices
+EXPORT_CACHE_MAX_SIZE = 32 * 1024 * 1024
+
+if xlsxwriter is not None:
+    # xlsxwriter has no compression option, so hand its ZipFile the level
+    xlsxwriter.workbook.ZipFile = functools.partial(zipfile.ZipFile, compresslevel=EXPORT_ZIP_LEVEL)
+
+# filename="..." in a multipart part header, matched on the raw bytes
+MULTIPART_FILENAME_RE = re.compile(rb'filename="([^"]*)"')
 
 # Store uploaded files and processing state
 app_state = {
@@ -58,19 +165,36 @@ app_state = {
     'file_data': [],
     'filter_file': None
 }
+# Requests are served on separate threads; guard every app_state mutation
+app_state_lock = threading.Lock()
+# Workbook generation runs here; request threads wait on the result
+export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS)
+# Export request body hash -> xlsx bytes, least recently used first
+export_cache = OrderedDict()
+export_cache_lock = threading.Lock()
+# Suffix for export filenames, so two exports in the same second get different names
+export_sequence = itertools.count(1)
+
+# Folder the app and its page are served from
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Static files kept in memory, with their content type
+STATIC_FILES = {'/index.html': 'text/html; charset=utf-8'}
+# path -> (mtime, raw bytes, gzip bytes); reloaded when the file changes on disk
+static_cache = {}
+static_cache_lock = threading.Lock()
 
 class MatrixProcessorHandler(SimpleHTTPRequestHandler):
     # Increase timeout for large file uploads
     timeout = 300  # 5 minutes timeout
     
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=os.path.dirname(os.path.abspath(__file__)), **kwargs)
+        super().__init__(*args, directory=APP_DIR, **kwargs)
     
     def log_message(self, format, *args):
         pass  # Suppress logging
     
     def send_json(self, data, status=200):
-        response = json.dumps(data).encode('utf-8')
+        response = json_bytes(data)
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', len(response))
@@ -78,14 +202,35 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(response)
     
-    def send_file_download(self, data, filename):
+    def send_json_list(self, key, items, status=200):
+        """Send {key: [...]} encoding and writing one item at a time.
+        
+        Avoids building the whole response in memory for large payloads. The
+        server speaks HTTP/1.0, so the body simply ends when the connection
+        closes and no Content-Length is needed.
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(b'{' + json_bytes(key) + b':[')
+        for idx, item in enumerate(items):
+            if idx:
+                self.wfile.write(b',')
+            self.wfile.write(json_bytes(item))
+        self.wfile.write(b']}')
+    
+    def send_file_download(self, fileobj, filename):
+        """Send a file object as an attachment, copying it to the socket in chunks"""
+        size = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(0)
         self.send_response(200)
         self.send_header('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
         self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
-        self.send_header('Content-Length', len(data))
+        self.send_header('Content-Length', size)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(data)
+        shutil.copyfileobj(fileobj, self.wfile, EXPORT_CHUNK_SIZE)
     
     def do_OPTIONS(self):
         self.send_response(200)
@@ -107,9 +252,46 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
         
         if self.path == '/api/status':
             self.send_json({'status': 'ok', 'files': len(app_state['file_data'])})
+        elif self.path in STATIC_FILES and self.send_static(self.path):
+            return
         else:
             super().do_GET()
     
+    def load_static(self, path):
+        """Return (raw, gzipped) bytes for a static file, reading it only when it changed"""
+        file_path = os.path.join(APP_DIR, path.lstrip('/'))
+        mtime = os.stat(file_path).st_mtime_ns
+        with static_cache_lock:
+            cached = static_cache.get(path)
+            if cached is None or cached[0] != mtime:
+                with open(file_path, 'rb') as f:
+                    raw = f.read()
+                cached = (mtime, raw, gzip.compress(raw))
+                static_cache[path] = cached
+        return cached[1], cached[2]
+    
+    def send_static(self, path):
+        """Serve a static file from memory, gzipped when the browser accepts it.
+        
+        Returns False when the file cannot be read, so the default handler can
+        answer with its usual error page.
+        """
+        try:
+            raw, gzipped = self.load_static(path)
+        except OSError:
+            return False
+        use_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = gzipped if use_gzip else raw
+        self.send_response(200)
+        self.send_header('Content-Type', STATIC_FILES[path])
+        self.send_header('Content-Length', len(body))
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+    
     def do_POST(self):
         try:
             content_length = int(self.headers.get('Content-Length', 0))
@@ -128,14 +310,16 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
             elif self.path == '/api/export':
                 self.handle_export(content_length)
             elif self.path == '/api/reset':
-                app_state['files'] = {}
-                app_state['file_data'] = []
-                app_state['filter_file'] = None
+                with app_state_lock:
+                    app_state['files'] = {}
+                    app_state['file_data'] = []
+                    app_state['filter_file'] = None
                 logger.info("App state reset")
                 self.send_json({'status': 'ok'})
             elif self.path == '/api/clear-files':
-                app_state['files'] = {}
-                app_state['file_data'] = []
+                with app_state_lock:
+                    app_state['files'] = {}
+                    app_state['file_data'] = []
                 logger.info("Files cleared for new batch upload")
                 self.send_json({'status': 'ok'})
             else:
@@ -148,6 +332,67 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
             except:
                 pass
     
+    def iter_multipart_files(self, content_length, boundary):
+        """Yield (filename, content) for each file part of a multipart body.
+        
+        The body is parsed while it is read: each part is emitted as soon as
+        its closing delimiter arrives and only the unparsed tail is kept in
+        memory, so an upload is never held twice (full body plus split copy).
+        """
+        delimiter = b'\r\n--' + boundary
+        buffer = bytearray(b'\r\n')  # Lets the first boundary match like the rest
+        remaining = content_length
+        chunk_size = 1024 * 1024  # 1MB chunks
+        in_part = False  # False until the first boundary (skips the preamble)
+        scan_from = 0
+        
+        try:
+            while True:
+                pos = buffer.find(delimiter, scan_from)
+                if pos < 0:
+                    if remaining <= 0:
+                        break
+                    chunk = self.rfile.read(min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    # Only rescan the bytes a delimiter could straddle
+                    scan_from = max(0, len(buffer) - len(delimiter) + 1)
+                    buffer += chunk
+                    continue
+                
+                if in_part:
+                    file_part = self.parse_multipart_part(buffer, pos)
+                    if file_part:
+                        yield file_part
+                del buffer[:pos + len(delimiter)]
+                in_part = True
+                scan_from = 0
+        finally:
+            # Drain anything left unread so the client never sees a reset connection
+            while remaining > 0:
+                chunk = self.rfile.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+    
+    def parse_multipart_part(self, buffer, end):
+        """Extract (filename, content) from buffer[:end], or None if the part is not a file"""
+        header_end = buffer.find(b'\r\n\r\n', 0, end)
+        if header_end < 0:
+            return None
+        
+        # Extract filename straight from the header bytes, without decoding the header
+        match = MULTIPART_FILENAME_RE.search(buffer, 0, header_end)
+        if not match:
+            return None
+        filename = match.group(1).decode('utf-8', errors='ignore')
+        
+        # Extract file content (a single copy out of the buffer)
+        with memoryview(buffer) as view:
+            file_content = view[header_end + 4:end].tobytes()
+        return filename, file_content
+    
     def handle_upload_single(self, content_length):
         """Handle single file upload - more reliable for many files"""
         content_type = self.headers.get('Content-Type', '')
@@ -159,55 +404,30 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
         try:
             boundary = content_type.split('boundary=')[1].encode()
             
-            # Read body in chunks
-            body = b''
-            remaining = content_length
-            chunk_size = 1024 * 1024  # 1MB chunks
-            while remaining > 0:
-                to_read = min(chunk_size, remaining)
-                chunk = self.rfile.read(to_read)
-                if not chunk:
-                    break
-                body += chunk
-                remaining -= len(chunk)
-            
-            parts = body.split(b'--' + boundary)
-            
-            for part in parts:
-                if b'filename="' in part:
-                    # Extract filename
-                    header_end = part.find(b'\r\n\r\n')
-                    header = part[:header_end].decode('utf-8', errors='ignore')
-                    filename_start = header.find('filename="') + 10
-                    filename_end = header.find('"', filename_start)
-                    filename = header[filename_start:filename_end]
+            for filename, file_content in self.iter_multipart_files(content_length, boundary):
+                if filename and file_content:
+                    logger.info(f"Processing single file: {filename} ({len(file_content)} bytes)")
                     
-                    # Extract file content
-                    file_content = part[header_end + 4:]
-                    if file_content.endswith(b'\r\n'):
-                        file_content = file_content[:-2]
-                    
-                    if filename and file_content:
-                        logger.info(f"Processing single file: {filename} ({len(file_content)} bytes)")
-                        
-                        try:
-                            file_info = self.process_file(filename, file_content)
+                    try:
+                        file_info = self.process_file(filename, file_content)
+                        with app_state_lock:
                             app_state['files'][filename] = file_content
                             app_state['file_data'].append(file_info)
-                            
-                            logger.info(f"Successfully processed: {filename}")
-                            self.send_json({
-                                'status': 'ok', 
-                                'file': file_info,
-                                'totalFiles': len(app_state['file_data'])
-                            })
-                            return
-                        except Exception as e:
-                            error_msg = f'Error al procesar {filename}: {str(e)}'
-                            logger.error(error_msg)
-                            logger.error(traceback.format_exc())
-                            self.send_json({'error': error_msg, 'filename': filename}, 400)
-                            return
+                            total_files = len(app_state['file_data'])
+                        
+                        logger.info(f"Successfully processed: {filename}")
+                        self.send_json({
+                            'status': 'ok', 
+                            'file': file_info,
+                            'totalFiles': total_files
+                        })
+                        return
+                    except Exception as e:
+                        error_msg = f'Error al procesar {filename}: {str(e)}'
+                        logger.error(error_msg)
+                        logger.error(traceback.format_exc())
+                        self.send_json({'error': error_msg, 'filename': filename}, 400)
+                        return
             
             self.send_json({'error': 'No se encontró archivo en la solicitud'}, 400)
             
@@ -222,53 +442,28 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
         
         if 'multipart/form-data' in content_type:
             try:
-                # Parse multipart form data
+                # Parse multipart form data as it is read
                 boundary = content_type.split('boundary=')[1].encode()
-                
-                # Read body in chunks to handle large uploads
-                body = b''
-                remaining = content_length
-                chunk_size = 1024 * 1024  # 1MB chunks
-                while remaining > 0:
-                    to_read = min(chunk_size, remaining)
-                    chunk = self.rfile.read(to_read)
-                    if not chunk:
-                        break
-                    body += chunk
-                    remaining -= len(chunk)
-                
                 logger.info(f"Received upload request: {content_length} bytes")
                 
-                parts = body.split(b'--' + boundary)
                 files_processed = []
-                
-                for part in parts:
-                    if b'filename="' in part:
-                        # Extract filename
-                        header_end = part.find(b'\r\n\r\n')
-                        header = part[:header_end].decode('utf-8', errors='ignore')
-                        filename_start = header.find('filename="') + 10
-                        filename_end = header.find('"', filename_start)
-                        filename = header[filename_start:filename_end]
-                        
-                        # Extract file content
-                        file_content = part[header_end + 4:]
-                        if file_content.endswith(b'\r\n'):
-                            file_content = file_content[:-2]
-                        
-                        if filename and file_content:
+                for filename, file_content in self.iter_multipart_files(content_length, boundary):
+                    if filename and file_content:
+                        with app_state_lock:
                             app_state['files'][filename] = file_content
-                            files_processed.append(filename)
-                            logger.info(f"Received file: {filename} ({len(file_content)} bytes)")
+                        files_processed.append(filename)
+                        logger.info(f"Received file: {filename} ({len(file_content)} bytes)")
                 
-                # Process all uploaded files
-                app_state['file_data'] = []
+                # Process all uploaded files outside the lock, then publish the result
+                with app_state_lock:
+                    uploaded_files = list(app_state['files'].items())
+                file_data = []
                 errors = []
-                for filename, content in app_state['files'].items():
+                for filename, content in uploaded_files:
                     try:
                         logger.info(f"Processing: {filename}")
                         file_info = self.process_file(filename, content)
-                        app_state['file_data'].append(file_info)
+                        file_data.append(file_info)
                         logger.info(f"Successfully processed: {filename}")
                     except Exception as e:
                         error_msg = f'{filename}: {str(e)}'
@@ -276,7 +471,10 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
                         logger.error(f"Error processing {filename}: {e}")
                         logger.error(traceback.format_exc())
                 
-                if errors and not app_state['file_data']:
+                with app_state_lock:
+                    app_state['file_data'] = file_data
+                
+                if errors and not file_data:
                     # All files failed
                     self.send_json({'error': f'Error al procesar archivos:\n' + '\n'.join(errors)}, 400)
                     return
@@ -284,7 +482,7 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
                     # Some files failed but some succeeded
                     logger.warning(f"Warnings: {len(errors)} files had errors: {errors}")
                 
-                self.send_json({'status': 'ok', 'files': app_state['file_data']})
+                self.send_json({'status': 'ok', 'files': file_data})
             except Exception as e:
                 logger.error(f"Error in handle_upload: {str(e)}")
                 logger.error(traceback.format_exc())
@@ -292,6 +490,38 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
         else:
             self.send_json({'error': 'Tipo de contenido inválido'}, 400)
     
+    def normalize_dataframe(self, df):
+        """Trim headers and turn every cell into a stripped string ('' for missing).
+        
+        Columns are converted one by one with vectorized string ops instead of
+        DataFrame.apply, which dispatches a Python lambda per column. Columns
+        that already hold only strings are stripped in place of being copied
+        through astype(str) first.
+        """
+        headers = [str(col).strip() for col in df.columns]
+        # Work by position so headers that collide after trimming stay separate
+        df.columns = range(len(headers))
+        for col in df.columns:
+            values = df[col]
+            if is_numeric_dtype(values):
+                # Numbers never carry surrounding whitespace: format them once
+                # and blank out the missing ones, skipping fillna and strip
+                text = values.astype(str)
+                if values.hasnans:
+                    text = text.where(values.notna(), '')
+                df[col] = text
+            elif infer_dtype(values, skipna=True) == 'string':
+                df[col] = values.fillna('').str.strip()
+            else:
+                # Dates and mixed cells: astype(str) keeps NaT as missing,
+                # so blank the missing ones after formatting
+                text = values.astype(str)
+                if values.hasnans:
+                    text = text.where(values.notna(), '')
+                df[col] = text.str.strip()
+        df.columns = headers
+        return df
+    
     def process_file(self, filename, content):
         """Process an Excel or CSV file"""
         file_info = {
@@ -313,10 +543,9 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
                 else:
                     df = pd.read_csv(BytesIO(content), encoding='utf-8', errors='ignore')
                 
-                # Trim headers and data
-                df.columns = [str(col).strip() for col in df.columns]
+                df = self.normalize_dataframe(df)
                 headers = df.columns.tolist()
-                data = df.fillna('').astype(str).apply(lambda x: x.str.strip()).to_dict('records')
+                data = df.to_dict('records')
                 file_info['sheets'].append({
                     'name': 'Sheet1',
                     'headers': headers,
@@ -325,16 +554,15 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
                 logger.info(f"CSV processed: {len(headers)} columns, {len(data)} rows")
             else:
                 logger.info(f"Reading Excel: {filename}")
-                xlsx = pd.ExcelFile(BytesIO(content))
+                xlsx = pd.ExcelFile(BytesIO(content), engine=EXCEL_READ_ENGINE)
                 logger.info(f"Excel has {len(xlsx.sheet_names)} sheets: {xlsx.sheet_names}")
                 
                 for sheet_name in xlsx.sheet_names:
                     try:
                         df = pd.read_excel(xlsx, sheet_name=sheet_name)
-                        # Trim headers and data
-                        df.columns = [str(col).strip() for col in df.columns]
+                        df = self.normalize_dataframe(df)
                         headers = df.columns.tolist()
-                        data = df.fillna('').astype(str).apply(lambda x: x.str.strip()).to_dict('records')
+                        data = df.to_dict('records')
                         file_info['sheets'].append({
                             'name': sheet_name,
                             'headers': headers,
@@ -365,48 +593,23 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
             
         try:
             boundary = content_type.split('boundary=')[1].encode()
-            
-            # Read body in chunks to handle large uploads
-            body = b''
-            remaining = content_length
-            chunk_size = 1024 * 1024  # 1MB chunks
-            while remaining > 0:
-                to_read = min(chunk_size, remaining)
-                chunk = self.rfile.read(to_read)
-                if not chunk:
-                    break
-                body += chunk
-                remaining -= len(chunk)
-            
             logger.info(f"Received filter file upload: {content_length} bytes")
             
-            parts = body.split(b'--' + boundary)
-            
-            for part in parts:
-                if b'filename="' in part:
-                    header_end = part.find(b'\r\n\r\n')
-                    header = part[:header_end].decode('utf-8', errors='ignore')
-                    filename_start = header.find('filename="') + 10
-                    filename_end = header.find('"', filename_start)
-                    filename = header[filename_start:filename_end]
-                    
-                    file_content = part[header_end + 4:]
-                    if file_content.endswith(b'\r\n'):
-                        file_content = file_content[:-2]
-                    
-                    if filename and file_content:
-                        logger.info(f"Processing filter file: {filename} ({len(file_content)} bytes)")
-                        try:
-                            file_info = self.process_file(filename, file_content)
+            for filename, file_content in self.iter_multipart_files(content_length, boundary):
+                if filename and file_content:
+                    logger.info(f"Processing filter file: {filename} ({len(file_content)} bytes)")
+                    try:
+                        file_info = self.process_file(filename, file_content)
+                        with app_state_lock:
                             app_state['filter_file'] = file_info
-                            logger.info(f"Successfully processed filter file: {filename}")
-                            self.send_json({'status': 'ok', 'file': file_info})
-                            return
-                        except Exception as e:
-                            logger.error(f"Error processing filter file {filename}: {e}")
-                            logger.error(traceback.format_exc())
-                            self.send_json({'error': f'Error al procesar archivo de filtro: {str(e)}'}, 400)
-                            return
+                        logger.info(f"Successfully processed filter file: {filename}")
+                        self.send_json({'status': 'ok', 'file': file_info})
+                        return
+                    except Exception as e:
+                        logger.error(f"Error processing filter file {filename}: {e}")
+                        logger.error(traceback.format_exc())
+                        self.send_json({'error': f'Error al procesar archivo de filtro: {str(e)}'}, 400)
+                        return
             
             self.send_json({'error': 'No se encontró archivo'}, 400)
         except Exception as e:
@@ -422,7 +625,7 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
         """Compute matrices based on configuration"""
         try:
             body = self.rfile.read(content_length)
-            config = json.loads(body.decode('utf-8'))
+            config = json_loads(body)
             logger.info(f"Computing matrices with {len(config.get('matrixConfig', []))} configurations")
             
             # Extract filter config if present
@@ -455,20 +658,40 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
                 filter_column_mappings
             )
             logger.info(f"Generated {len(matrices)} matrices")
-            self.send_json({'matrices': matrices})
+            self.send_json_list('matrices', matrices)
         except Exception as e:
             logger.error(f"Error in handle_compute: {str(e)}")
             logger.error(traceback.format_exc())
             self.send_json({'error': str(e)}, 400)
     
-    def get_row_value(self, row, x_axis_columns):
-        """Get combined row value from multiple columns"""
-        parts = []
-        for col in x_axis_columns:
-            val = str(row.get(col, '')).strip()
-            if val:
-                parts.append(val)
-        return ' | '.join(parts) if parts else ''
+    def sheet_row_count(self, sheet):
+        """Number of data rows in a sheet sent by the browser"""
+        if 'columns' in sheet:
+            return sheet['rowCount']
+        return len(sheet['data'])
+    
+    def column_values(self, sheet, column):
+        """Get one column of a sheet as a list of strings.
+        
+        The browser sends the sheets of /api/compute column-wise ('columns',
+        holding only the columns the configuration uses); row dicts ('data')
+        are still accepted. process_file already stores every cell as a
+        stripped string, so the values are read as-is without a per-cell
+        str()/strip().
+        """
+        if 'columns' in sheet:
+            values = sheet['columns'].get(column)
+            if values is None:
+                return [''] * sheet['rowCount']
+            return values
+        return [row.get(column, '') for row in sheet['data']]
+    
+    def get_row_values(self, sheet, x_axis_columns):
+        """Get the combined row value from multiple columns for every row"""
+        if not x_axis_columns:
+            return [''] * self.sheet_row_count(sheet)
+        columns = [self.column_values(sheet, col) for col in x_axis_columns]
+        return [' | '.join([val for val in parts if val]) for parts in zip(*columns)]
     
     def extract_c_id(self, value):
         """Extract the unique ID (C followed by 4-8 digits) from a string.
@@ -535,6 +758,65 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
         
         return canonical_values, value_mapping
     
+    def build_filter_matcher(self, filter_values):
+        """Prepare lowercase filter values for matching rows.
+        
+        Returns a dict with the values as a frozenset ('values', checked by the
+        exact match against a mapped source column) and a substring matcher
+        that scans each row once instead of once per filter value: an
+        Aho-Corasick automaton ('automaton') when pyahocorasick is installed,
+        otherwise a compiled regex alternation ('pattern').
+        """
+        values = frozenset(filter_values)
+        matcher = {
+            'values': values,
+            'automaton': None,
+            'pattern': None
+        }
+        if ahocorasick is not None and values and '' not in values:
+            automaton = ahocorasick.Automaton()
+            for val in values:
+                automaton.add_word(val, val)
+            automaton.make_automaton()
+            matcher['automaton'] = automaton
+        elif values:
+            # Longest first so the alternation never stops at a shorter prefix
+            matcher['pattern'] = re.compile('|'.join(
+                re.escape(val) for val in sorted(values, key=len, reverse=True)
+            ))
+        return matcher
+    
+    def filter_mask(self, x_values, filter_column, matcher):
+        """Return a list of booleans marking which rows pass the filter.
+        
+        Args:
+            x_values: Combined X axis value of each row
+            filter_column: Source column values (from column_values) to match
+                exactly, or None to fall back to substring matching against
+                the X value
+            matcher: Matcher built by build_filter_matcher
+        
+        Rows repeat the same values, so each distinct value is normalized and
+        matched once.
+        """
+        if filter_column is not None:
+            # Use the mapped source column to get value and match against filter
+            values = matcher['values']
+            matches = {val: val.strip().lower() in values for val in set(filter_column)}
+            return [matches[val] for val in filter_column]
+        
+        # Fallback: check if any filter value is in the row value
+        automaton = matcher['automaton']
+        pattern = matcher['pattern']
+        if automaton is not None:
+            matches = {x_val: next(automaton.iter(x_val.lower()), None) is not None for x_val in set(x_values)}
+        elif pattern is not None:
+            search = pattern.search
+            matches = {x_val: search(x_val.lower()) is not None for x_val in set(x_values)}
+        else:
+            return [False] * len(x_values)
+        return [matches[x_val] for x_val in x_values]
+    
     def compute_matrices(self, file_data, selected_tabs, column_selections, matrix_config, filter_data=None, source_mappings=None, filter_column_mappings=None):
         """Compute intersection matrices with multi-column X axis support
         
@@ -548,471 +830,718 @@ class MatrixProcessorHandler(SimpleHTTPRequestHandler):
         if filter_column_mappings is None:
             filter_column_mappings = {}
         
-        matrices = []
+        # Build matchers once per filter column in use, not once per source
+        filter_matchers = {}
+        if filter_data:
+            for filter_col in set(filter_column_mappings.values()):
+                if filter_col in filter_data:
+                    filter_matchers[filter_col] = self.build_filter_matcher(filter_data[filter_col])
         
+        # Look up sheets by (file index, sheet name) instead of scanning each file
+        sheets_by_key = {
+            (file_idx, sheet['name']): sheet
+            for file_idx, file in enumerate(file_data)
+            for sheet in file['sheets']
+        }
+        
+        # Resolve each source once: its axis values and filter result
+        # (None when the sheet does not exist)
+        sources_by_key = {}
         for config in matrix_config:
-            if config.get('merge'):
-                # Merge all sources into one matrix
-                y_values = set()
-                x_values = set()
+            for source in config['sources']:
+                key = f"{source['fileIndex']}-{source['sheetName']}"
+                if key in sources_by_key:
+                    continue
                 
-                # Collect unique values
-                for source in config['sources']:
-                    file_idx = source['fileIndex']
-                    sheet_name = source['sheetName']
-                    key = f"{file_idx}-{sheet_name}"
-                    
-                    file = file_data[file_idx]
-                    sheet = next((s for s in file['sheets'] if s['name'] == sheet_name), None)
-                    if not sheet:
-                        continue
-                    
-                    sel = column_selections.get(key, {})
-                    y_col = sel.get('yAxis')
-                    x_cols = sel.get('xAxisMultiple', [])
-                    
-                    # Fallback to single xAxis if xAxisMultiple not set
-                    if not x_cols and sel.get('xAxis'):
-                        x_cols = [sel.get('xAxis')]
-                    
-                    # Get filter column for this source (which column in data file to match)
-                    source_filter_col = source_mappings.get(key)
-                    # Get which filter file column to use for this source
-                    filter_file_col = filter_column_mappings.get(key)
-                    
-                    # Get the filter values for this source's filter column
-                    source_filter_values = None
-                    if filter_data and filter_file_col and filter_file_col in filter_data:
-                        source_filter_values = filter_data[filter_file_col]
-                    
-                    for row in sheet['data']:
-                        y_val = str(row.get(y_col, '')).strip()
-                        x_val = self.get_row_value(row, x_cols)
-                        
-                        if y_val:
-                            y_values.add(y_val)
-                        if x_val:
-                            # Apply filter if present - using source-specific columns
-                            if source_filter_values is None:
-                                x_values.add(x_val)
-                            elif source_filter_col:
-                                # Use the mapped source column to get value and match against filter
-                                filter_val = str(row.get(source_filter_col, '')).strip().lower()
-                                if filter_val in source_filter_values:
-                                    x_values.add(x_val)
-                            else:
-                                # Fallback: check if any filter value is in the row value
-                                x_val_lower = x_val.lower()
-                                if any(fv in x_val_lower for fv in source_filter_values):
-                                    x_values.add(x_val)
+                sheet = sheets_by_key.get((source['fileIndex'], source['sheetName']))
+                if not sheet:
+                    sources_by_key[key] = None
+                    continue
                 
-                # Homologate X values by C ID to merge duplicates with same ID
-                homologated_x, x_value_mapping = self.homologate_x_values(x_values)
+                sel = column_selections.get(key, {})
+                x_cols = sel.get('xAxisMultiple', [])
+                # Fallback to single xAxis if xAxisMultiple not set
+                if not x_cols and sel.get('xAxis'):
+                    x_cols = [sel.get('xAxis')]
                 
-                sorted_y = sorted(y_values)
-                sorted_x = sorted(homologated_x)
+                row_x_values = self.get_row_values(sheet, x_cols)
                 
-                matrix_data = [[0] * len(sorted_y) for _ in range(len(sorted_x))]
+                # Apply filter if present - using source-specific columns
+                keep = None
+                # Which column in the data file to match against the filter
+                source_filter_col = source_mappings.get(key)
+                # Prebuilt matcher for the filter file column this source uses
+                source_matcher = filter_matchers.get(filter_column_mappings.get(key))
+                if source_matcher is not None:
+                    filter_column = None
+                    if source_filter_col:
+                        filter_column = self.column_values(sheet, source_filter_col)
+                    keep = self.filter_mask(row_x_values, filter_column, source_matcher)
                 
-                for source in config['sources']:
-                    file_idx = source['fileIndex']
-                    sheet_name = source['sheetName']
-                    key = f"{file_idx}-{sheet_name}"
-                    
-                    file = file_data[file_idx]
-                    sheet = next((s for s in file['sheets'] if s['name'] == sheet_name), None)
-                    if not sheet:
-                        continue
-                    
-                    sel = column_selections.get(key, {})
-                    y_col = sel.get('yAxis')
-                    x_cols = sel.get('xAxisMultiple', [])
-                    
-                    if not x_cols and sel.get('xAxis'):
-                        x_cols = [sel.get('xAxis')]
-                    
-                    for row in sheet['data']:
-                        y_val = str(row.get(y_col, '')).strip()
-                        x_val = self.get_row_value(row, x_cols)
-                        
-                        if y_val and x_val:
-                            # Map to canonical form using homologation
-                            canonical_x = x_value_mapping.get(x_val, x_val)
-                            if y_val in sorted_y and canonical_x in sorted_x:
-                                y_idx = sorted_y.index(y_val)
-                                x_idx = sorted_x.index(canonical_x)
-                                matrix_data[x_idx][y_idx] = 1
-                
-                matrices.append({
-                    'name': config['name'],
-                    'yAxis': sorted_y,
-                    'xAxis': sorted_x,
-                    'data': matrix_data
-                })
+                # Per-row Y value, combined X value and filter flag, read once per
+                # source and reused by every pass and every matrix that includes it
+                sources_by_key[key] = {
+                    'y_values': self.column_values(sheet, sel.get('yAxis')),
+                    'x_values': row_x_values,
+                    'keep': keep
+                }
+        
+        matrices = []
+        
+        for config in matrix_config:
+            resolved_sources = [
+                sources_by_key[f"{source['fileIndex']}-{source['sheetName']}"]
+                for source in config['sources']
+            ]
+            resolved_sources = [resolved for resolved in resolved_sources if resolved]
+            
+            if config.get('merge'):
+                # Merge all sources into one matrix
+                matrices.append(self.build_matrix(config['name'], resolved_sources))
             else:
                 # Create independent matrix for each source
-                for source in config['sources']:
-                    file_idx = source['fileIndex']
-                    sheet_name = source['sheetName']
-                    key = f"{file_idx}-{sheet_name}"
-                    
-                    file = file_data[file_idx]
-                    sheet = next((s for s in file['sheets'] if s['name'] == sheet_name), None)
-                    if not sheet:
-                        continue
-                    
-                    sel = column_selections.get(key, {})
-                    y_col = sel.get('yAxis')
-                    x_cols = sel.get('xAxisMultiple', [])
-                    
-                    if not x_cols and sel.get('xAxis'):
-                        x_cols = [sel.get('xAxis')]
-                    
-                    # Get filter column for this source (which column in data file to match)
-                    source_filter_col = source_mappings.get(key)
-                    # Get which filter file column to use for this source
-                    filter_file_col = filter_column_mappings.get(key)
-                    
-                    # Get the filter values for this source's filter column
-                    source_filter_values = None
-                    if filter_data and filter_file_col and filter_file_col in filter_data:
-                        source_filter_values = filter_data[filter_file_col]
-                    
-                    y_values = set()
-                    x_values = set()
-                    
-                    for row in sheet['data']:
-                        y_val = str(row.get(y_col, '')).strip()
-                        x_val = self.get_row_value(row, x_cols)
-                        
-                        if y_val:
-                            y_values.add(y_val)
-                        if x_val:
-                            # Apply filter if present - using source-specific columns
-                            if source_filter_values is None:
-                                x_values.add(x_val)
-                            elif source_filter_col:
-                                # Use the mapped source column to get value and match against filter
-                                filter_val = str(row.get(source_filter_col, '')).strip().lower()
-                                if filter_val in source_filter_values:
-                                    x_values.add(x_val)
-                            else:
-                                # Fallback: check if any filter value is in the row value
-                                x_val_lower = x_val.lower()
-                                if any(fv in x_val_lower for fv in source_filter_values):
-                                    x_values.add(x_val)
-                    
-                    # Homologate X values by C ID to merge duplicates with same ID
-                    homologated_x, x_value_mapping = self.homologate_x_values(x_values)
-                    
-                    sorted_y = sorted(y_values)
-                    sorted_x = sorted(homologated_x)
-                    
-                    # matrix_data[x_idx][y_idx] - X is rows, Y is columns
-                    matrix_data = [[0] * len(sorted_y) for _ in range(len(sorted_x))]
-                    
-                    for row in sheet['data']:
-                        y_val = str(row.get(y_col, '')).strip()
-                        x_val = self.get_row_value(row, x_cols)
-                        
-                        if y_val and x_val:
-                            # Map to canonical form using homologation
-                            canonical_x = x_value_mapping.get(x_val, x_val)
-                            if y_val in sorted_y and canonical_x in sorted_x:
-                                y_idx = sorted_y.index(y_val)
-                                x_idx = sorted_x.index(canonical_x)
-                                matrix_data[x_idx][y_idx] = 1
-                    
-                    matrices.append({
-                        'name': config['name'],
-                        'yAxis': sorted_y,
-                        'xAxis': sorted_x,
-                        'data': matrix_data
-                    })
+                for resolved in resolved_sources:
+                    matrices.append(self.build_matrix(config['name'], [resolved]))
         
         return matrices
     
-    def handle_export(self, content_length):
-        """Export matrices to Excel with Consulta sheet"""
-        try:
-            body = self.rfile.read(content_length)
-            data = json.loads(body.decode('utf-8'))
-            matrices = data.get('matrices', [])
-            logger.info(f"Exporting {len(matrices)} matrices to Excel")
-            wb = Workbook()
-            wb.remove(wb.active)
+    def build_matrix(self, name, sources):
+        """Build one matrix from resolved sources, reading each source's rows once.
+        
+        A single pass collects the Y labels, the X labels that pass the filter
+        and the distinct (x, y) pairs; cells are marked from the pairs once
+        the axes are known.
+        """
+        y_values = set()
+        x_values = set()
+        pairs = set()
+        
+        for resolved in sources:
+            keep = resolved['keep']
+            for row_idx, (y_val, x_val) in enumerate(zip(resolved['y_values'], resolved['x_values'])):
+                if y_val:
+                    y_values.add(y_val)
+                    if x_val:
+                        pairs.add((x_val, y_val))
+                if x_val and (keep is None or keep[row_idx]):
+                    x_values.add(x_val)
+        
+        # Homologate X values by C ID to merge duplicates with same ID
+        homologated_x, x_value_mapping = self.homologate_x_values(x_values)
+        
+        sorted_y = sorted(y_values)
+        sorted_x = sorted(homologated_x)
+        # Label -> position maps for O(1) cell lookups
+        y_index = {y_val: idx for idx, y_val in enumerate(sorted_y)}
+        x_index = {x_val: idx for idx, x_val in enumerate(sorted_x)}
+        
+        # matrix_data[x_idx, y_idx] - X is rows, Y is columns
+        matrix_data = np.zeros((len(sorted_x), len(sorted_y)), dtype=np.uint8)
+        self.mark_cells(matrix_data, pairs, y_index, x_index, x_value_mapping)
+        
+        return {
+            'name': name,
+            'yAxis': sorted_y,
+            'xAxis': sorted_x,
+            'packed': self.pack_matrix(matrix_data)
+        }
+    
+    def mark_cells(self, matrix_data, pairs, y_index, x_index, x_value_mapping):
+        """Set matrix_data[x, y] = 1 for every (x, y) pair whose labels are both in the matrix.
+        
+        Labels are turned into positions once per pair (-1 when absent) and the
+        cells are set in a single NumPy fancy-index assignment instead of a
+        Python loop over the grid.
+        """
+        # Map X values to their canonical form using homologation
+        coords = np.array(
+            [(x_index.get(x_value_mapping.get(x_val, x_val), -1), y_index.get(y_val, -1)) for x_val, y_val in pairs],
+            dtype=np.intp
+        ).reshape(-1, 2)
+        valid = (coords >= 0).all(axis=1)
+        matrix_data[coords[valid, 0], coords[valid, 1]] = 1
+    
+    def pack_matrix(self, matrix_data):
+        """Bitpack a 0/1 matrix (2-D uint8 array), 8 cells per byte along each row.
+        
+        Returns the packed bytes as base64 so the matrix travels to the
+        browser and back to /api/export at 1/8 of a byte per cell instead of
+        a JSON list of ints.
+        """
+        return base64.b64encode(np.packbits(matrix_data, axis=1).tobytes()).decode('ascii')
+    
+    def packed_matrix(self, matrix):
+        """Return a matrix as a (rows, ceil(cols / 8)) uint8 array of packed bits.
+        
+        Accepts both the 'packed' form produced by compute_matrices and a plain
+        'data' list of 0/1 rows.
+        """
+        num_rows = len(matrix['xAxis'])
+        num_cols = len(matrix['yAxis'])
+        if 'packed' in matrix:
+            packed = np.frombuffer(base64.b64decode(matrix['packed']), dtype=np.uint8)
+            return packed.reshape(num_rows, (num_cols + 7) // 8)
+        
+        dense = np.zeros((num_rows, num_cols), dtype=np.uint8)
+        for row_idx, row in enumerate(matrix.get('data', [])[:num_rows]):
+            row = row[:num_cols]
+            dense[row_idx, :len(row)] = np.equal(row, 1)
+        return np.packbits(dense, axis=1)
+    
+    def build_consulta_data(self, matrices):
+        """Collect what the Consulta sheet needs from the matrices.
+        
+        Returns a dict with:
+            matrix_names: Matrix names truncated for display, one Consulta column each
+            row_values: Every row value across matrices, sorted case-insensitively
+            lookups: Per entry of matrix_names, the (key, permission) pairs for the
+                hidden lookup columns, keyed "row_value|index"
+            num_result_rows: Number of result rows shown under the dropdown
+            dropdown_col: 1-based hidden column holding the dropdown values
+            lookup_start_col: 1-based first hidden Key/Value column pair
+            lookup_formulas: Per entry of lookups, the VLOOKUP formula shared by
+                all its result rows, or None when it has no entries
+        """
+        # Collect data per matrix: {matrix_name: {row_val: [perm1, perm2, ...]}}
+        matrix_data_lookup = {}
+        all_row_values = set()
+        matrix_names = [m['name'][:30] for m in matrices]  # Truncate names for display
+        
+        for matrix in matrices:
+            matrix_name = matrix['name'][:30]
+            rows = matrix['xAxis']
+            cols = matrix['yAxis']
+            row_perms = matrix_data_lookup.setdefault(matrix_name, {})
+            all_row_values.update(rows)
             
-            # Styles
-            header_font = Font(bold=True, color="FFFFFF")
-            header_fill = PatternFill(start_color="2563EB", end_color="2563EB", fill_type="solid")
-            header_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
-            cell_border = Border(
-                left=Side(style='thin', color='E2E8F0'),
-                right=Side(style='thin', color='E2E8F0'),
-                top=Side(style='thin', color='E2E8F0'),
-                bottom=Side(style='thin', color='E2E8F0')
+            # One nonzero scan per matrix visits only the 1 cells, in row order
+            dense = np.unpackbits(self.packed_matrix(matrix), axis=1, count=len(cols))
+            row_idxs, col_idxs = np.nonzero(dense)
+            for row_idx, col_idx in zip(row_idxs.tolist(), col_idxs.tolist()):
+                row_perms.setdefault(rows[row_idx], []).append(cols[col_idx])
+        
+        # Sort once on precomputed (lowercase, original) pairs; the original
+        # value breaks ties so the order no longer depends on set iteration
+        sorted_row_values = [val for _, val in sorted((val.lower(), val) for val in all_row_values)]
+        
+        # Deduplicate and sort each user's permissions once per matrix
+        presorted_perms = {
+            matrix_name: {row_val: sorted(set(perms)) for row_val, perms in row_perms.items()}
+            for matrix_name, row_perms in matrix_data_lookup.items()
+        }
+        
+        # Calculate max permissions any user has in any matrix, counted once per
+        # distinct matrix name on the deduplicated lists that become result rows
+        max_perms = max(
+            (len(perms) for row_perms in presorted_perms.values() for perms in row_perms.values()),
+            default=1
+        )
+        
+        # Key format: "user_value|index"
+        lookups = []
+        for matrix_name in matrix_names:
+            matrix_perms = presorted_perms.get(matrix_name, {})
+            lookups.append([
+                (f"{row_val}|{perm_idx}", perm)
+                for row_val in sorted_row_values if row_val in matrix_perms
+                for perm_idx, perm in enumerate(matrix_perms[row_val], start=1)
+            ])
+        
+        # Hidden dropdown column after all matrix columns + buffer, then one
+        # hidden Key (user|index) / Value (permission) column pair per matrix
+        dropdown_col = len(matrix_names) + 4
+        lookup_start_col = dropdown_col + 2
+        num_result_rows = max(max_perms, 25)
+        
+        # Result rows start below the header in row 6, so ROW()-6 is the result
+        # number and every result row of a matrix can share one formula text
+        lookup_formulas = []
+        for matrix_idx, entries in enumerate(lookups):
+            if not entries:
+                lookup_formulas.append(None)
+                continue
+            key_col = COLUMN_LETTERS[lookup_start_col + matrix_idx * 2]
+            val_col = COLUMN_LETTERS[lookup_start_col + matrix_idx * 2 + 1]
+            # VLOOKUP formula: =IFERROR(VLOOKUP($B$4&"|"&row_num, key_col:val_col, 2, FALSE), "")
+            lookup_formulas.append(
+                f'=IFERROR(VLOOKUP($B$4&"|"&(ROW()-6),${key_col}$1:${val_col}${len(entries)},2,FALSE),"")'
             )
-            one_fill = PatternFill(start_color="DCFCE7", end_color="DCFCE7", fill_type="solid")
-            
-            # ========== CONSULTA SHEET ==========
-            # Dynamic lookup with dropdown - one column per matrix
-            lookup_ws = wb.create_sheet(title="Consulta")
-            
-            # Collect data per matrix: {matrix_name: {row_val: [perm1, perm2, ...]}}
-            matrix_data_lookup = {}
-            all_row_values = set()
-            matrix_names = [m['name'][:30] for m in matrices]  # Truncate names for display
-            
-            for matrix in matrices:
-                matrix_name = matrix['name'][:30]
-                rows = matrix['xAxis']
-                cols = matrix['yAxis']
-                m_data = matrix['data']
-                
-                if matrix_name not in matrix_data_lookup:
-                    matrix_data_lookup[matrix_name] = {}
-                
-                for row_idx, row_val in enumerate(rows):
-                    all_row_values.add(row_val)
-                    if row_idx < len(m_data):
-                        perms = []
-                        for col_idx, val in enumerate(m_data[row_idx]):
-                            if val == 1 and col_idx < len(cols):
-                                perms.append(cols[col_idx])
-                        if perms:
-                            if row_val not in matrix_data_lookup[matrix_name]:
-                                matrix_data_lookup[matrix_name][row_val] = []
-                            matrix_data_lookup[matrix_name][row_val].extend(perms)
-            
-            sorted_row_values = sorted(all_row_values, key=str.lower)
-            
-            # Calculate max permissions any user has in any matrix
-            max_perms = 1
-            for matrix_name in matrix_names:
-                for row_val, perms in matrix_data_lookup.get(matrix_name, {}).items():
-                    max_perms = max(max_perms, len(perms))
-            
-            num_result_rows = max(max_perms, 25)
-            num_cols = len(matrix_names) + 1
-            
-            # Title
-            lookup_ws.merge_cells(f'A1:{get_column_letter(num_cols)}1')
-            title_cell = lookup_ws['A1']
-            title_cell.value = "Consulta de Permisos por Usuario"
-            title_cell.font = Font(bold=True, size=16, color="1E293B")
-            title_cell.alignment = Alignment(horizontal="center", vertical="center")
-            lookup_ws.row_dimensions[1].height = 30
-            
-            # Subtitle
-            lookup_ws.merge_cells(f'A2:{get_column_letter(num_cols)}2')
-            subtitle_cell = lookup_ws['A2']
-            subtitle_cell.value = "Selecciona un usuario del menú desplegable para ver sus permisos"
-            subtitle_cell.font = Font(size=11, color="64748B")
-            subtitle_cell.alignment = Alignment(horizontal="center", vertical="center")
-            lookup_ws.row_dimensions[2].height = 25
+        
+        return {
+            'matrix_names': matrix_names,
+            'row_values': sorted_row_values,
+            'lookups': lookups,
+            'num_result_rows': num_result_rows,
+            'dropdown_col': dropdown_col,
+            'lookup_start_col': lookup_start_col,
+            'lookup_formulas': lookup_formulas
+        }
+    
+    def sheet_titles(self, matrices):
+        """Turn matrix names into unique, valid Excel sheet titles.
+        
+        Titles are at most 31 chars without \\ / * ? : [ ] or surrounding
+        apostrophes. Repeated titles (compared case-insensitively, "Consulta"
+        included) get a numeric suffix: "Name", "Name1", "Name2", ...
+        """
+        used = {'consulta'}
+        titles = []
+        for matrix in matrices:
+            # Sanitize sheet name (max 31 chars, no special chars)
+            title = matrix['name'][:31].translate(SHEET_TITLE_TRANSLATION).strip("'") or 'Matriz'
             
-            # Dropdown label
-            lookup_ws['A4'] = "Seleccionar Usuario:"
-            lookup_ws['A4'].font = Font(bold=True)
-            lookup_ws['A4'].alignment = Alignment(horizontal="right", vertical="center")
+            unique_title = title
+            suffix = 1
+            while unique_title.lower() in used:
+                unique_title = f"{title[:31 - len(str(suffix))]}{suffix}"
+                suffix += 1
+            used.add(unique_title.lower())
+            titles.append(unique_title)
+        return titles
+    
+    def write_workbook_xlsxwriter(self, output, matrices, consulta):
+        """Write the export workbook with xlsxwriter in constant_memory mode.
+        
+        Rows are streamed to the sheet XML as they are written instead of being
+        kept as cell objects, so every sheet must be written strictly top to
+        bottom.
+        """
+        wb = xlsxwriter.Workbook(output, {
+            'constant_memory': True,
+            # User values are always written as plain text, even when they
+            # start with "="; the openpyxl writer does the same
+            'strings_to_formulas': False,
+            'strings_to_urls': False
+        })
+        
+        # Formats
+        border = {'border': 1, 'border_color': '#E2E8F0'}
+        header_fmt = wb.add_format({
+            'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#2563EB',
+            'align': 'center', 'valign': 'vcenter', 'text_wrap': True, **border
+        })
+        corner_fmt = wb.add_format({'bg_color': '#2563EB', **border})
+        row_header_fmt = wb.add_format({'bold': True, 'bg_color': '#F1F5F9', **border})
+        one_fmt = wb.add_format({
+            'bold': True, 'font_color': '#16A34A', 'bg_color': '#DCFCE7', 'align': 'center', **border
+        })
+        title_fmt = wb.add_format({
+            'bold': True, 'font_size': 16, 'font_color': '#1E293B', 'align': 'center', 'valign': 'vcenter'
+        })
+        subtitle_fmt = wb.add_format({
+            'font_size': 11, 'font_color': '#64748B', 'align': 'center', 'valign': 'vcenter'
+        })
+        label_fmt = wb.add_format({'bold': True, 'align': 'right', 'valign': 'vcenter'})
+        input_fmt = wb.add_format({'bg_color': '#FEF3C7', 'border': 2, 'border_color': '#F59E0B'})
+        number_fmt = wb.add_format({'font_color': '#94A3B8', 'align': 'center', **border})
+        result_fmt = wb.add_format({'valign': 'vcenter', **border})
+        inst_title_fmt = wb.add_format({'bold': True, 'font_color': '#64748B'})
+        inst_fmt = wb.add_format({'font_color': '#64748B'})
+        
+        # ========== CONSULTA SHEET ==========
+        # Dynamic lookup with dropdown - one column per matrix
+        matrix_names = consulta['matrix_names']
+        row_values = consulta['row_values']
+        lookups = consulta['lookups']
+        num_result_rows = consulta['num_result_rows']
+        lookup_formulas = consulta['lookup_formulas']
+        num_cols = len(matrix_names) + 1
+        # Hidden columns, 0-based for xlsxwriter
+        dropdown_col = consulta['dropdown_col'] - 1
+        lookup_start_col = consulta['lookup_start_col'] - 1
+        
+        lookup_ws = wb.add_worksheet('Consulta')
+        lookup_ws.set_column(0, 0, 20)
+        if matrix_names:
+            lookup_ws.set_column(1, len(matrix_names), 35)
+        else:
+            lookup_ws.set_column(1, 1, 45)
+        lookup_ws.set_column(dropdown_col, dropdown_col, None, None, {'hidden': True})
+        if lookups:
+            lookup_ws.set_column(lookup_start_col, lookup_start_col + 2 * len(lookups) - 1, None, None, {'hidden': True})
+        lookup_ws.set_row(0, 30)
+        lookup_ws.set_row(1, 25)
+        
+        # Create dropdown in B4
+        if row_values:
+            dropdown_letter = COLUMN_LETTERS[dropdown_col + 1]
+            lookup_ws.data_validation(3, 1, 3, 1, {
+                'validate': 'list',
+                'source': f"=${dropdown_letter}$1:${dropdown_letter}${len(row_values)}",
+                'ignore_blank': True,
+                'error_title': "Valor inválido",
+                'error_message': "Por favor selecciona un valor de la lista",
+                'input_title': "Lista de usuarios",
+                'input_message': "Selecciona un usuario"
+            })
+        
+        # Visible cells per row; written interleaved with the hidden lookup data
+        # below because constant_memory only accepts rows in ascending order
+        visible = {}
+        title = "Consulta de Permisos por Usuario"
+        subtitle = "Selecciona un usuario del menú desplegable para ver sus permisos"
+        if num_cols > 1:
+            visible[0] = [(lookup_ws.merge_range, (0, 0, 0, num_cols - 1, title, title_fmt))]
+            visible[1] = [(lookup_ws.merge_range, (1, 0, 1, num_cols - 1, subtitle, subtitle_fmt))]
+        else:
+            visible[0] = [(lookup_ws.write_string, (0, 0, title, title_fmt))]
+            visible[1] = [(lookup_ws.write_string, (1, 0, subtitle, subtitle_fmt))]
+        visible[3] = [
+            (lookup_ws.write_string, (3, 0, "Seleccionar Usuario:", label_fmt)),
+            (lookup_ws.write_blank, (3, 1, None, input_fmt))
+        ]
+        
+        # Headers row - "#" column + one column per matrix
+        visible[5] = [(lookup_ws.write_string, (5, 0, "#", header_fmt))]
+        for col_idx, matrix_name in enumerate(matrix_names, start=1):
+            visible[5].append((lookup_ws.write_string, (5, col_idx, matrix_name, header_fmt)))
+        
+        # Result rows with VLOOKUP formulas are written straight from the
+        # per-matrix formulas in the row loop below
+        result_rows = range(6, 6 + num_result_rows)
+        
+        # Instructions
+        inst_row = 6 + num_result_rows + 2
+        visible[inst_row] = [(lookup_ws.write_string, (inst_row, 0, "Instrucciones:", inst_title_fmt))]
+        for offset, text in enumerate([
+            "1. Selecciona un usuario del menú desplegable en la celda amarilla (B4)",
+            "2. Los permisos de cada matriz aparecerán automáticamente en columnas separadas",
+            "3. Cada permiso aparece en una fila diferente para facilitar la lectura"
+        ], start=1):
+            visible[inst_row + offset] = [(lookup_ws.write_string, (inst_row + offset, 0, text, inst_fmt))]
+        
+        last_row = max([inst_row + 4, len(row_values)] + [len(entries) for entries in lookups])
+        for row in range(last_row):
+            for write, args in visible.get(row, ()):
+                write(*args)
+            if row in result_rows:
+                i = row - 6
+                lookup_ws.write_number(row, 0, i + 1, number_fmt)
+                for col_idx, formula in enumerate(lookup_formulas, start=1):
+                    if formula:
+                        lookup_ws.write_formula(row, col_idx, formula, result_fmt, '')
+                    else:
+                        lookup_ws.write_blank(row, col_idx, None, result_fmt)
+            if row < len(row_values):
+                lookup_ws.write_string(row, dropdown_col, row_values[row])
+            for matrix_idx, entries in enumerate(lookups):
+                if row < len(entries):
+                    key, perm = entries[row]
+                    lookup_ws.write_string(row, lookup_start_col + matrix_idx * 2, key)
+                    lookup_ws.write_string(row, lookup_start_col + matrix_idx * 2 + 1, perm)
+        
+        # ========== MATRIX SHEETS ==========
+        for matrix, sheet_title in zip(matrices, self.sheet_titles(matrices)):
+            ws = wb.add_worksheet(sheet_title)
+            y_axis = matrix['yAxis']
+            m_data = np.unpackbits(self.packed_matrix(matrix), axis=1, count=len(y_axis))
             
-            # Store dropdown values in a hidden column (column after all matrix columns + buffer)
-            dropdown_col = num_cols + 3
-            for idx, val in enumerate(sorted_row_values, start=1):
-                lookup_ws.cell(row=idx, column=dropdown_col, value=val)
-            lookup_ws.column_dimensions[get_column_letter(dropdown_col)].hidden = True
+            # Column widths and panes must be set before rows are streamed
+            ws.set_column(0, 0, 40)
+            if y_axis:
+                ws.set_column(1, len(y_axis), 15)
+            ws.freeze_panes(1, 1)
             
-            # Create dropdown in B4
-            if sorted_row_values:
-                dv = DataValidation(
-                    type="list",
-                    formula1=f"${get_column_letter(dropdown_col)}$1:${get_column_letter(dropdown_col)}${len(sorted_row_values)}",
-                    allow_blank=True
-                )
-                dv.error = "Por favor selecciona un valor de la lista"
-                dv.errorTitle = "Valor inválido"
-                dv.prompt = "Selecciona un usuario"
-                dv.promptTitle = "Lista de usuarios"
-                lookup_ws.add_data_validation(dv)
-                dv.add(lookup_ws['B4'])
+            # Header row - Y axis (columns) as column headers
+            ws.write_blank(0, 0, None, corner_fmt)
+            ws.write_row(0, 1, y_axis, header_fmt)
             
-            lookup_ws['B4'].fill = PatternFill(start_color="FEF3C7", end_color="FEF3C7", fill_type="solid")
-            lookup_ws['B4'].border = Border(
-                left=Side(style='medium', color='F59E0B'),
-                right=Side(style='medium', color='F59E0B'),
-                top=Side(style='medium', color='F59E0B'),
-                bottom=Side(style='medium', color='F59E0B')
+            # Data rows - X axis (rows) as row labels. Only the 1 cells are
+            # written; empty cells are left out and show Excel's gridlines
+            for row_idx, x_val in enumerate(matrix['xAxis'], start=1):
+                ws.write_string(row_idx, 0, x_val, row_header_fmt)
+                if row_idx <= len(m_data):
+                    for col_idx in np.flatnonzero(m_data[row_idx - 1]).tolist():
+                        ws.write_number(row_idx, col_idx + 1, 1, one_fmt)
+        
+        wb.close()
+    
+    def set_column_range(self, ws, first_col, last_col, **attrs):
+        """Set openpyxl column attributes for a 1-based column range as one <col> entry"""
+        if last_col < first_col:
+            return
+        dim = ws.column_dimensions[COLUMN_LETTERS[first_col]]
+        dim.min, dim.max = first_col, last_col
+        for attr, value in attrs.items():
+            setattr(dim, attr, value)
+    
+    def write_only_cell(self, ws, value, style, formula=False):
+        """Create a write-only cell carrying one of the workbook's named styles.
+        
+        openpyxl stores any string starting with "=" as a formula; unless
+        formula is True the value is kept as text, like the xlsxwriter writer.
+        """
+        cell = WriteOnlyCell(ws, value=value)
+        if not formula and isinstance(value, str) and value.startswith('='):
+            cell.data_type = 's'
+        cell.style = style
+        return cell
+    
+    def text_value(self, ws, value):
+        """Return an unstyled string for ws.append, wrapped in a text cell if openpyxl would read it as a formula"""
+        if value.startswith('='):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.data_type = 's'
+            return cell
+        return value
+    
+    def write_workbook_openpyxl(self, output, matrices, consulta):
+        """Write the export workbook with openpyxl (used when xlsxwriter is not installed).
+        
+        Uses write-only mode: rows are serialized as they are appended instead of
+        being kept as cell objects, so sheets are built strictly top to bottom and
+        column/row dimensions are set before the first append.
+        """
+        wb = Workbook(write_only=True)
+        
+        # Named styles: assigning one by name is a single lookup instead of
+        # validating font/fill/border/alignment per cell. Created per workbook
+        # because add_named_style binds the style to it
+        wb.add_named_style(NamedStyle(
+            name='matrix_header', font=HEADER_FONT, fill=HEADER_FILL, alignment=HEADER_ALIGN, border=CELL_BORDER
+        ))
+        wb.add_named_style(NamedStyle(name='matrix_corner', fill=HEADER_FILL, border=CELL_BORDER))
+        wb.add_named_style(NamedStyle(
+            name='matrix_row_header', font=ROW_HEADER_FONT, fill=ROW_HEADER_FILL, border=CELL_BORDER
+        ))
+        wb.add_named_style(NamedStyle(
+            name='matrix_one', font=ONE_FONT, fill=ONE_FILL, alignment=CENTER_ALIGN, border=CELL_BORDER
+        ))
+        wb.add_named_style(NamedStyle(
+            name='consulta_title', font=Font(bold=True, size=16, color="FF1E293B"),
+            alignment=Alignment(horizontal="center", vertical="center")
+        ))
+        wb.add_named_style(NamedStyle(
+            name='consulta_subtitle', font=Font(size=11, color="FF64748B"),
+            alignment=Alignment(horizontal="center", vertical="center")
+        ))
+        wb.add_named_style(NamedStyle(
+            name='consulta_label', font=Font(bold=True), alignment=Alignment(horizontal="right", vertical="center")
+        ))
+        wb.add_named_style(NamedStyle(
+            name='consulta_input',
+            fill=PatternFill(start_color="FFFEF3C7", end_color="FFFEF3C7", fill_type="solid"),
+            border=Border(
+                left=Side(style='medium', color='FFF59E0B'),
+                right=Side(style='medium', color='FFF59E0B'),
+                top=Side(style='medium', color='FFF59E0B'),
+                bottom=Side(style='medium', color='FFF59E0B')
             )
-            lookup_ws.column_dimensions['A'].width = 20
-            lookup_ws.column_dimensions['B'].width = 45
-            
-            # Headers row - "#" column + one column per matrix
-            lookup_ws['A6'] = "#"
-            lookup_ws['A6'].font = header_font
-            lookup_ws['A6'].fill = header_fill
-            lookup_ws['A6'].alignment = header_align
-            lookup_ws['A6'].border = cell_border
+        ))
+        wb.add_named_style(NamedStyle(
+            name='consulta_number', font=Font(color="FF94A3B8"), alignment=CENTER_ALIGN, border=CELL_BORDER
+        ))
+        wb.add_named_style(NamedStyle(
+            name='consulta_result', alignment=Alignment(vertical="center"), border=CELL_BORDER
+        ))
+        wb.add_named_style(NamedStyle(name='consulta_inst_title', font=Font(bold=True, color="FF64748B")))
+        wb.add_named_style(NamedStyle(name='consulta_inst', font=Font(color="FF64748B")))
+        
+        # ========== CONSULTA SHEET ==========
+        # Dynamic lookup with dropdown - one column per matrix
+        lookup_ws = wb.create_sheet(title="Consulta")
+        
+        matrix_names = consulta['matrix_names']
+        sorted_row_values = consulta['row_values']
+        lookups = consulta['lookups']
+        num_result_rows = consulta['num_result_rows']
+        num_cols = len(matrix_names) + 1
+        dropdown_col = consulta['dropdown_col']
+        lookup_start_col = consulta['lookup_start_col']
+        
+        lookup_ws.merged_cells.add(f'A1:{COLUMN_LETTERS[num_cols]}1')
+        lookup_ws.merged_cells.add(f'A2:{COLUMN_LETTERS[num_cols]}2')
+        lookup_ws.row_dimensions[1].height = 30
+        lookup_ws.row_dimensions[2].height = 25
+        lookup_ws.column_dimensions['A'].width = 20
+        lookup_ws.column_dimensions['B'].width = 45
+        self.set_column_range(lookup_ws, 2, num_cols, width=35)
+        lookup_ws.column_dimensions[COLUMN_LETTERS[dropdown_col]].hidden = True
+        self.set_column_range(lookup_ws, lookup_start_col, lookup_start_col + 2 * len(lookups) - 1, hidden=True)
+        
+        # Create dropdown in B4
+        if sorted_row_values:
+            dv = DataValidation(
+                type="list",
+                formula1=f"${COLUMN_LETTERS[dropdown_col]}$1:${COLUMN_LETTERS[dropdown_col]}${len(sorted_row_values)}",
+                allow_blank=True
+            )
+            dv.error = "Por favor selecciona un valor de la lista"
+            dv.errorTitle = "Valor inválido"
+            dv.prompt = "Selecciona un usuario"
+            dv.promptTitle = "Lista de usuarios"
+            dv.add('B4')
+            lookup_ws.data_validations.append(dv)
+        
+        # Visible cells per row as {column: cell}; merged with the hidden lookup
+        # data below because write-only sheets only accept whole rows in order
+        visible = {
+            1: {1: self.write_only_cell(lookup_ws, "Consulta de Permisos por Usuario", 'consulta_title')},
+            2: {1: self.write_only_cell(
+                lookup_ws, "Selecciona un usuario del menú desplegable para ver sus permisos", 'consulta_subtitle'
+            )},
+            4: {
+                1: self.write_only_cell(lookup_ws, "Seleccionar Usuario:", 'consulta_label'),
+                2: self.write_only_cell(lookup_ws, None, 'consulta_input')
+            }
+        }
+        
+        # Headers row - "#" column + one column per matrix
+        visible[6] = {1: self.write_only_cell(lookup_ws, "#", 'matrix_header')}
+        for col_idx, matrix_name in enumerate(matrix_names, start=2):
+            visible[6][col_idx] = self.write_only_cell(lookup_ws, matrix_name, 'matrix_header')
+        
+        # Result rows with VLOOKUP formulas are built straight from the
+        # per-matrix formulas in the row loop below
+        lookup_formulas = consulta['lookup_formulas']
+        result_rows = range(7, 7 + num_result_rows)
+        
+        # Instructions
+        inst_row = 7 + num_result_rows + 2
+        visible[inst_row] = {1: self.write_only_cell(lookup_ws, "Instrucciones:", 'consulta_inst_title')}
+        for offset, text in enumerate([
+            "1. Selecciona un usuario del menú desplegable en la celda amarilla (B4)",
+            "2. Los permisos de cada matriz aparecerán automáticamente en columnas separadas",
+            "3. Cada permiso aparece en una fila diferente para facilitar la lectura"
+        ], start=1):
+            visible[inst_row + offset] = {1: self.write_only_cell(lookup_ws, text, 'consulta_inst')}
+        
+        last_row = max([inst_row + 3, len(sorted_row_values)] + [len(entries) for entries in lookups])
+        for row_num in range(1, last_row + 1):
+            cells = visible.get(row_num, {})
+            if row_num in result_rows:
+                i = row_num - 7
+                cells[1] = self.write_only_cell(lookup_ws, i + 1, 'consulta_number')
+                for col_idx, formula in enumerate(lookup_formulas, start=2):
+                    cells[col_idx] = self.write_only_cell(lookup_ws, formula or "", 'consulta_result', formula=True)
+            if row_num <= len(sorted_row_values):
+                cells[dropdown_col] = self.text_value(lookup_ws, sorted_row_values[row_num - 1])
+            for matrix_idx, entries in enumerate(lookups):
+                if row_num <= len(entries):
+                    key, perm = entries[row_num - 1]
+                    cells[lookup_start_col + matrix_idx * 2] = self.text_value(lookup_ws, key)
+                    cells[lookup_start_col + matrix_idx * 2 + 1] = self.text_value(lookup_ws, perm)
+            lookup_ws.append([cells.get(col_idx) for col_idx in range(1, max(cells, default=0) + 1)])
+        
+        # ========== MATRIX SHEETS ==========
+        for matrix, sheet_title in zip(matrices, self.sheet_titles(matrices)):
+            ws = wb.create_sheet(title=sheet_title)
+            m_data = np.unpackbits(self.packed_matrix(matrix), axis=1, count=len(matrix['yAxis']))
             
-            for col_idx, matrix_name in enumerate(matrix_names, start=2):
-                cell = lookup_ws.cell(row=6, column=col_idx, value=matrix_name)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = header_align
-                cell.border = cell_border
-                lookup_ws.column_dimensions[get_column_letter(col_idx)].width = 35
+            # Adjust column widths and freeze panes before any row is written
+            ws.column_dimensions['A'].width = 40
+            self.set_column_range(ws, 2, len(matrix['yAxis']) + 1, width=15)
+            ws.freeze_panes = 'B2'
             
-            # Build lookup data for each matrix in hidden columns
-            # Structure: For each matrix, create columns with Key (user|index) and Value (permission)
-            lookup_start_col = dropdown_col + 2
-            matrix_lookup_ranges = {}
+            # Header row - Y axis (columns) as column headers
+            ws.append([self.write_only_cell(ws, '', 'matrix_corner')] + [
+                self.write_only_cell(ws, y_val, 'matrix_header') for y_val in matrix['yAxis']
+            ])
             
-            for matrix_idx, matrix_name in enumerate(matrix_names):
-                key_col = lookup_start_col + (matrix_idx * 2)
-                val_col = key_col + 1
-                
-                row_num = 1
-                matrix_perms = matrix_data_lookup.get(matrix_name, {})
-                
-                for row_val in sorted_row_values:
-                    if row_val in matrix_perms:
-                        for perm_idx, perm in enumerate(sorted(set(matrix_perms[row_val])), start=1):
-                            # Key format: "user_value|index"
-                            lookup_ws.cell(row=row_num, column=key_col, value=f"{row_val}|{perm_idx}")
-                            lookup_ws.cell(row=row_num, column=val_col, value=perm)
-                            row_num += 1
-                
-                # Store range info
-                if row_num > 1:
-                    matrix_lookup_ranges[matrix_name] = {
-                        'key_col': get_column_letter(key_col),
-                        'val_col': get_column_letter(val_col),
-                        'last_row': row_num - 1
-                    }
-                
-                # Hide these columns
-                lookup_ws.column_dimensions[get_column_letter(key_col)].hidden = True
-                lookup_ws.column_dimensions[get_column_letter(val_col)].hidden = True
+            # Data rows - X axis (rows) as row labels. Only the 1 cells are
+            # written; empty cells are left out and show Excel's gridlines
+            num_y = len(matrix['yAxis'])
+            for x_idx, x_val in enumerate(matrix['xAxis']):
+                row = [self.write_only_cell(ws, x_val, 'matrix_row_header')] + [None] * num_y
+                if x_idx < len(m_data):
+                    for col_idx in np.flatnonzero(m_data[x_idx]).tolist():
+                        row[col_idx + 1] = self.write_only_cell(ws, 1, 'matrix_one')
+                ws.append(row)
+        
+        # Same as wb.save(output) but with the configured compression level
+        archive = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=EXPORT_ZIP_LEVEL)
+        ExcelWriter(wb, archive).save()
+    
+    def write_workbook(self, output, matrices):
+        """Write the export workbook to output with the best available writer"""
+        consulta = self.build_consulta_data(matrices)
+        if xlsxwriter is not None:
+            self.write_workbook_xlsxwriter(output, matrices, consulta)
+        else:
+            self.write_workbook_openpyxl(output, matrices, consulta)
+    
+    def cached_export(self, key):
+        """Return the cached xlsx bytes for an export request hash, or None"""
+        with export_cache_lock:
+            content = export_cache.get(key)
+            if content is not None:
+                export_cache.move_to_end(key)
+            return content
+    
+    def cache_export(self, key, content):
+        """Remember an export's xlsx bytes, evicting the oldest ones past EXPORT_CACHE_MAX_SIZE"""
+        with export_cache_lock:
+            export_cache[key] = content
+            export_cache.move_to_end(key)
+            total = sum(len(cached) for cached in export_cache.values())
+            while total > EXPORT_CACHE_MAX_SIZE:
+                _, evicted = export_cache.popitem(last=False)
+                total -= len(evicted)
+    
+    def handle_export(self, content_length):
+        """Export matrices to Excel with Consulta sheet"""
+        try:
+            body = self.rfile.read(content_length)
+            timestamp = time.strftime('%Y%m%d_%H%M%S')
+            filename = f'matrices_{timestamp}_{next(export_sequence):04d}.xlsx'
             
-            # Create result rows with VLOOKUP formulas
-            for i in range(num_result_rows):
-                result_row = 7 + i
-                
-                # Row number
-                cell = lookup_ws.cell(row=result_row, column=1, value=i + 1)
-                cell.border = cell_border
-                cell.alignment = Alignment(horizontal="center")
-                cell.font = Font(color="94A3B8")
-                
-                # For each matrix, create VLOOKUP formula
-                for matrix_idx, matrix_name in enumerate(matrix_names, start=2):
-                    if matrix_name in matrix_lookup_ranges:
-                        info = matrix_lookup_ranges[matrix_name]
-                        key_col = info['key_col']
-                        val_col = info['val_col']
-                        last_row = info['last_row']
-                        
-                        # VLOOKUP formula: =IFERROR(VLOOKUP($B$4&"|"&row_num, key_col:val_col, 2, FALSE), "")
-                        formula = f'=IFERROR(VLOOKUP($B$4&"|"&{i+1},${key_col}$1:${val_col}${last_row},2,FALSE),"")'
-                        cell = lookup_ws.cell(row=result_row, column=matrix_idx, value=formula)
-                    else:
-                        cell = lookup_ws.cell(row=result_row, column=matrix_idx, value="")
-                    
-                    cell.border = cell_border
-                    cell.alignment = Alignment(vertical="center")
+            # The same request always builds the same workbook, so exporting
+            # unchanged matrices again is answered from the cache
+            cache_key = hashlib.blake2b(body, digest_size=16).digest()
+            cached = self.cached_export(cache_key)
+            if cached is not None:
+                self.send_file_download(BytesIO(cached), filename)
+                logger.info(f"Successfully exported from cache: {filename}")
+                return
             
-            # Instructions
-            inst_row = 7 + num_result_rows + 2
-            lookup_ws.cell(row=inst_row, column=1, value="Instrucciones:")
-            lookup_ws.cell(row=inst_row, column=1).font = Font(bold=True, color="64748B")
-            lookup_ws.cell(row=inst_row + 1, column=1, value="1. Selecciona un usuario del menú desplegable en la celda amarilla (B4)")
-            lookup_ws.cell(row=inst_row + 1, column=1).font = Font(color="64748B")
-            lookup_ws.cell(row=inst_row + 2, column=1, value="2. Los permisos de cada matriz aparecerán automáticamente en columnas separadas")
-            lookup_ws.cell(row=inst_row + 2, column=1).font = Font(color="64748B")
-            lookup_ws.cell(row=inst_row + 3, column=1, value="3. Cada permiso aparece en una fila diferente para facilitar la lectura")
-            lookup_ws.cell(row=inst_row + 3, column=1).font = Font(color="64748B")
+            data = json_loads(body)
+            matrices = data.get('matrices', [])
+            logger.info(f"Exporting {len(matrices)} matrices to Excel")
             
-            # ========== MATRIX SHEETS ==========
-            for matrix in matrices:
-                # Sanitize sheet name (max 31 chars, no special chars)
-                sheet_name = matrix['name'][:31]
-                for char in ['\\', '/', '*', '?', ':', '[', ']']:
-                    sheet_name = sheet_name.replace(char, '_')
-                
-                ws = wb.create_sheet(title=sheet_name)
+            # Small exports stay in memory, large ones spill to a temp file;
+            # either way the file is streamed to the socket without a copy
+            with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE) as output:
+                # Built on the shared export pool, which caps how many
+                # workbooks are generated (and held in memory) at once
+                export_executor.submit(self.write_workbook, output, matrices).result()
                 
-                # Header row - Y axis (columns) as column headers
-                ws.cell(row=1, column=1, value='')
-                ws.cell(row=1, column=1).fill = header_fill
-                ws.cell(row=1, column=1).border = cell_border
+                # Only exports that stayed in memory are cached
+                if output.tell() <= EXPORT_SPOOL_MAX_SIZE:
+                    output.seek(0)
+                    self.cache_export(cache_key, output.read())
                 
-                for col_idx, y_val in enumerate(matrix['yAxis'], start=2):
-                    cell = ws.cell(row=1, column=col_idx, value=y_val)
-                    cell.font = header_font
-                    cell.fill = header_fill
-                    cell.alignment = header_align
-                    cell.border = cell_border
-                
-                # Data rows - X axis (rows) as row labels
-                for row_idx, x_val in enumerate(matrix['xAxis'], start=2):
-                    # Row header
-                    row_header = ws.cell(row=row_idx, column=1, value=x_val)
-                    row_header.font = Font(bold=True)
-                    row_header.fill = PatternFill(start_color="F1F5F9", end_color="F1F5F9", fill_type="solid")
-                    row_header.border = cell_border
-                    
-                    # Data cells
-                    x_idx = row_idx - 2
-                    if x_idx < len(matrix['data']):
-                        for col_idx, val in enumerate(matrix['data'][x_idx], start=2):
-                            cell = ws.cell(row=row_idx, column=col_idx, value=val if val == 1 else '')
-                            cell.border = cell_border
-                            cell.alignment = Alignment(horizontal="center")
-                            if val == 1:
-                                cell.fill = one_fill
-                                cell.font = Font(bold=True, color="16A34A")
-                
-                # Adjust column widths
-                ws.column_dimensions['A'].width = 40
-                for col_idx in range(2, len(matrix['yAxis']) + 2):
-                    ws.column_dimensions[get_column_letter(col_idx)].width = 15
-                
-                # Freeze panes
-                ws.freeze_panes = 'B2'
-            
-            # Save to bytes
-            output = BytesIO()
-            wb.save(output)
-            output.seek(0)
-            
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f'matrices_{timestamp}.xlsx'
-            
-            self.send_file_download(output.read(), filename)
+                self.send_file_download(output, filename)
             logger.info(f"Successfully exported: {filename}")
         except Exception as e:
             logger.error(f"Error in handle_export: {str(e)}")
             logger.error(traceback.format_exc())
             self.send_json({'error': str(e)}, 500)
 
-
-def run_server(port=8080):
-    """Start the web server"""
-    # Create server with larger request limits
-    server = HTTPServer(('127.0.0.1', port), MatrixProcessorHandler)
+def run_server(port=8080, open_browser=True):
+    """Start the web server, opening the app in the browser unless open_browser is False"""
+    # Create server with larger request limits; one thread per request so a long
+    # compute or export does not block status polls and static files
+    server = ThreadingHTTPServer(('127.0.0.1', port), MatrixProcessorHandler)
     server.request_queue_size = 10  # Allow more pending connections
     print(f"\n{'='*50}")
     print(f"  PROCESADOR DE MATRICES")
     print(f"{'='*50}")
     print(f"\n  Servidor ejecutándose en: http://localhost:{port}")
-    print(f"\n  Abriendo navegador...")
+    if open_browser:
+        print(f"\n  Abriendo navegador...")
     print(f"\n  Mantén esta ventana abierta mientras usas la app.")
     print(f"  Presiona Ctrl+C para detener.")
     print(f"\n  Los logs se muestran abajo para diagnóstico.\n")
     print(f"{'='*50}\n")
     logger.info("Server started successfully")
+    if xlsxwriter is None:
+        logger.info(f"Excel export: openpyxl {'with lxml' if OPENPYXL_LXML else 'without lxml'} (install xlsxwriter for faster exports)")
+    else:
+        logger.info("Excel export: xlsxwriter")
     
-    # Open browser after a short delay
-    threading.Timer(1.0, lambda: webbrowser.open(f'http://localhost:{port}')).start()
+    if open_browser:
+        # Open browser after a short delay
+        threading.Timer(1.0, lambda: webbrowser.open(f'http://localhost:{port}')).start()
     
     try:
         server.serve_forever()
@@ -1022,4 +1551,4 @@ def run_server(port=8080):
 
 
 if __name__ == '__main__':
-    run_server()
+    run_server(open_browser='--no-browser' not in sys.argv[1:])